@@ -0,0 +1,24 @@
+import threading
+
+import boto3
+
+
+class ClientPool(object):
+    """
+    boto3 clients shared across requests (and worker threads), keyed by (service, region).
+
+    Clients are thread-safe once created but creating them from the default session is not, so creation is locked.
+    """
+    def __init__(self):
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def get(self, service, region=None):
+        key = (service, region)
+        with self.lock:
+            if key not in self.clients:
+                self.clients[key] = boto3.client(service, region_name=region)
+            return self.clients[key]
+
+
+clients = ClientPool()
@@ -1,11 +1,68 @@
+import os
+import json
+import time
 import logging
-import boto3
+from datetime import datetime
 from botocore.exceptions import ClientError
 
 from cfn_resource_provider import ResourceProvider
 
+from clients import clients
+from pending_operations import pending_operations, PENDING
+
 log = logging.getLogger()
 
+# state-change notifications (EventBridge events) that complete pending registrations.  WorkSpaces does not
+# publish these so they are only used when a producer is configured to emit them with this source.
+EVENT_DETAIL_TYPE = 'WorkSpaces Directory State Change'
+EVENT_SOURCE = os.getenv('DIRECTORY_EVENT_SOURCE')
+# in case the event never arrives, an EventBridge Scheduler schedule re-invokes the provider to check the directory
+CHECK_DETAIL_TYPE = 'WorkSpaces Directory Pending Check'
+CHECK_ROLE_ARN = os.getenv('EVENT_CHECK_ROLE_ARN')
+EVENT_POLL_INTERVAL = int(os.getenv('EVENT_POLL_INTERVAL', '300'))
+
+
+def is_state_change_event(event):
+    """
+    returns True for state-change events and scheduled checks, both of which are handled by `handle_event`
+    """
+    return bool(EVENT_SOURCE) and event.get('source') == EVENT_SOURCE \
+        and event.get('detail-type') in [EVENT_DETAIL_TYPE, CHECK_DETAIL_TYPE]
+
+
+def state_change_event(directory_id, state):
+    """
+    returns a state-change event for `directory_id` as a producer (or test harness) would emit it
+    """
+    return {
+        'source': EVENT_SOURCE,
+        'detail-type': EVENT_DETAIL_TYPE,
+        'detail': {'DirectoryId': directory_id, 'State': state},
+    }
+
+
+def schedule_check(directory_id, function_arn):
+    """
+    schedules a one-time check of `directory_id` by `function_arn` after EVENT_POLL_INTERVAL seconds
+    """
+    now = time.time()
+    at = datetime.utcfromtimestamp(now + EVENT_POLL_INTERVAL).strftime('%Y-%m-%dT%H:%M:%S')
+    clients.get('scheduler').create_schedule(
+        Name=f'directory-check-{directory_id}-{int(now * 1000)}',
+        ScheduleExpression=f'at({at})',
+        FlexibleTimeWindow={'Mode': 'OFF'},
+        ActionAfterCompletion='DELETE',
+        Target={
+            'Arn': function_arn,
+            'RoleArn': CHECK_ROLE_ARN,
+            'Input': json.dumps({
+                'source': EVENT_SOURCE,
+                'detail-type': CHECK_DETAIL_TYPE,
+                'detail': {'DirectoryId': directory_id, 'FunctionArn': function_arn},
+            }),
+        },
+    )
+
 
 request_schema = {
     "type": "object",
@@ -146,6 +203,11 @@ class WorkspacesDirectoryRegistrationProvider(ResourceProvider):
         super().__init__()
         self.request_schema = request_schema
         self.workspaces = None
+        self.deferred = False
+
+    def set_request(self, request, context):
+        super().set_request(request, context)
+        self.deferred = False
 
     @property
     def region(self):
@@ -193,6 +255,30 @@ class WorkspacesDirectoryRegistrationProvider(ResourceProvider):
             return None
         return directories[0]
 
+    def track_pending(self):
+        """
+        hands the wait over to the state-change event (with a scheduled fallback check) so this invocation can return
+        """
+        function_arn = getattr(self.context, 'invoked_function_arn', None)
+        if not self.event_driven or not function_arn:
+            return
+        try:
+            pending_operations.put(self.directory_id, self.request, self.response)
+        except ClientError as error:
+            log.warning(f'Unable to record pending operation, falling back to polling: {error}')
+            return
+        try:
+            schedule_check(self.directory_id, function_arn)
+        except ClientError as error:
+            log.warning(f'Unable to schedule a fallback check, falling back to polling: {error}')
+            # claim the operation so the event does not respond as well; if it already has, there is nothing to wait for
+            try:
+                if pending_operations.complete(self.directory_id, self.request_id):
+                    return
+            except ClientError:
+                return
+        self.deferred = True
+
     def update_attributes(self, changed_properties=None):
         if changed_properties is None:
             changed_properties = set(self.properties.keys())
@@ -248,7 +334,7 @@ class WorkspacesDirectoryRegistrationProvider(ResourceProvider):
     # CloudFormation Handlers
     def create(self):
         # must defer this since region is in the payload
-        self.workspaces = boto3.client("workspaces", region_name=self.region)
+        self.workspaces = clients.get("workspaces", self.region)
         try:
             # register_workspace_directory
             arguments = self.make_arguments({
@@ -276,12 +362,13 @@ class WorkspacesDirectoryRegistrationProvider(ResourceProvider):
             else:
                 self.physical_resource_id = "failed-after-create"
             raise
+        self.track_pending()
 
     KEYS_COMPLEX_REPLACMENT = {'DirectoryId', 'SubnetIds', 'Tenancy', 'EnableWorkDocs', 'EnableSelfService', 'Tags'}
 
     def update(self):
         # must defer this since region is in the payload
-        self.workspaces = boto3.client("workspaces", region_name=self.region)
+        self.workspaces = clients.get("workspaces", self.region)
 
         new_keys = set(self.properties.keys())
         old_keys = (
@@ -313,7 +400,7 @@ class WorkspacesDirectoryRegistrationProvider(ResourceProvider):
         if self.physical_resource_id in ['failed-to-create', 'deleted']:
             return
         # must defer this since region is in the payload
-        self.workspaces = boto3.client("workspaces", region_name=self.region)
+        self.workspaces = clients.get("workspaces", self.region)
         try:
             directory = self.describe_workspace_directory()
             if directory is None:
@@ -330,6 +417,8 @@ class WorkspacesDirectoryRegistrationProvider(ResourceProvider):
             self.physical_resource_id = 'deleted'
         except ClientError as error:
             self.success("Ignore failure to delete certificate {}".format(error))
+            return
+        self.track_pending()
 
     def set_response_data(self, directory):
         self.physical_resource_id = directory['RegistrationCode']
@@ -340,7 +429,23 @@ class WorkspacesDirectoryRegistrationProvider(ResourceProvider):
         self.set_attribute('WorkspaceSecurityGroupId', directory['WorkspaceSecurityGroupId'])
         log.info(f'response data: {self.response}')
 
+    @property
+    def event_driven(self):
+        return pending_operations.enabled and bool(EVENT_SOURCE) and bool(CHECK_ROLE_ARN)
+
     def is_ready(self):
+        if self.deferred:
+            log.info('... waiting for state-change event')
+            return True
+        return self.check_directory()
+
+    def send_response(self):
+        if self.deferred:
+            log.info('response is sent on completion by the state-change event or scheduled check')
+            return
+        super().send_response()
+
+    def check_directory(self):
         log.info(f'check running for action {self.request_type}')
         directory = self.describe_workspace_directory()
         log.info(directory)
@@ -379,8 +484,38 @@ class WorkspacesDirectoryRegistrationProvider(ResourceProvider):
             raise ValueError(f"No check method for Request Type: {self.request_type}")
 
 
-provider = WorkspacesDirectoryRegistrationProvider()
+def handler(request, context):
+    # providers hold per-request state so each request gets its own instance
+    return WorkspacesDirectoryRegistrationProvider().handle(request, context)
 
 
-def handler(request, context):
-    return provider.handle(request, context)
+def handle_event(event, context):
+    """
+    completes the pending request for the directory named in a state-change event or scheduled check, if its transition
+    has finished.  A scheduled check that finds the directory still in transition schedules the next one.
+    """
+    directory_id = event.get('detail', {}).get('DirectoryId')
+    record = pending_operations.get(directory_id) if pending_operations.enabled and directory_id else None
+    if record is None or record['Status'] != PENDING:
+        log.info(f'No pending operation for {event.get("detail-type")} on directory {directory_id}')
+        return None
+    event_provider = WorkspacesDirectoryRegistrationProvider()
+    event_provider.set_request(record['Request'], context)
+    event_provider.response = record['Response']
+    event_provider.workspaces = clients.get("workspaces", event_provider.region)
+    if not event_provider.check_directory():
+        log.info(f'Directory {directory_id} is still in transition')
+        if event.get('detail-type') == CHECK_DETAIL_TYPE:
+            schedule_check(directory_id, event['detail']['FunctionArn'])
+        return None
+    if not pending_operations.complete(directory_id, event_provider.request_id):
+        return None
+    try:
+        event_provider.send_response()
+    except Exception:
+        # hand the operation back so the retried invocation (or the next check) can respond
+        pending_operations.reopen(directory_id, event_provider.request_id)
+        if event.get('detail-type') == CHECK_DETAIL_TYPE:
+            schedule_check(directory_id, event['detail']['FunctionArn'])
+        raise
+    return event_provider.response
@@ -1,10 +1,12 @@
 import logging
 
-import boto3
 from botocore.exceptions import ClientError
 
 from cfn_resource_provider import ResourceProvider
 
+from clients import clients
+from secret_cache import secret_cache
+
 log = logging.getLogger()
 
 
@@ -13,7 +15,7 @@ log = logging.getLogger()
 #
 request_schema = {
     "type": "object",
-    "required": ["OrganizationId", "Username", "Password", "GivenName", "Surname"],
+    "required": ["OrganizationId", "Username", "GivenName", "Surname"],
     "properties": {
         # create_user
         "OrganizationId": {
@@ -28,6 +30,11 @@ request_schema = {
             "type": "string",
             "description": "The password of the user.",
         },
+        # resolved to Password (so the password never appears in the template)
+        "PasswordSecret": {
+            "type": "string",
+            "description": "The Secrets Manager ARN or SSM SecureString parameter name holding the password of the user.",
+        },
         "GivenName": {
             "type": "string",
             "description": "The given name of the user.",
@@ -97,8 +104,14 @@ class DirectoryUserProvider(ResourceProvider):
     def username(self):
         return self.get("Username")
 
+    @property
+    def password_secret(self):
+        return self.get("PasswordSecret", None)
+
     @property
     def password(self):
+        if self.password_secret is not None:
+            return secret_cache.get(self.password_secret, self.region)
         return self.get("Password")
 
     @property
@@ -120,6 +133,15 @@ class DirectoryUserProvider(ResourceProvider):
     def convert_property_types(self):
         self.heuristic_convert_property_types(self.properties)
 
+    def is_valid_request(self):
+        if not super().is_valid_request():
+            return False
+        # exactly one source for the password
+        if ("Password" in self.properties) == ("PasswordSecret" in self.properties):
+            self.fail('Exactly one of Password or PasswordSecret must be provided')
+            return False
+        return True
+
     def make_arguments(self, valid_keys):
         arguments = {
             k: v for k, v in self.properties.items()
@@ -137,9 +159,16 @@ class DirectoryUserProvider(ResourceProvider):
 
     # CloudFormation Handlers
     def create(self):
-        workdocs = boto3.client("workdocs", region_name=self.region)
+        workdocs = clients.get("workdocs", self.region)
+        try:
+            # unresolvable secrets are reported in the batch response (not raised by boto) so surface as KeyError
+            password = self.password
+        except (ClientError, KeyError):
+            self.physical_resource_id = "failed-to-create"
+            raise
         try:
             arguments = self.make_arguments(self.KEYS_CREATE)
+            arguments['Password'] = password
             response = workdocs.create_user(**arguments)
             self.physical_resource_id = response["User"]["Id"]
             # some keys are not available for create, but are available for update
@@ -159,7 +188,7 @@ class DirectoryUserProvider(ResourceProvider):
             raise
 
     def update(self):
-        workdocs = boto3.client("workdocs", region_name=self.region)
+        workdocs = clients.get("workdocs", self.region)
 
         new_keys = set(self.properties.keys())
         old_keys = (
@@ -174,7 +203,8 @@ class DirectoryUserProvider(ResourceProvider):
             if self.get(name, None) != self.get_old(name, self.get(name)):
                 changed_properties.add(name)
 
-        keys_replacement = self.KEYS_CREATE - self.KEYS_UPDATE
+        # the password is only the initial password given to create_user so changing it (or its source) is a no-op
+        keys_replacement = self.KEYS_CREATE - self.KEYS_UPDATE - {"Password"}
         if changed_properties.intersection(keys_replacement):
             if 'Username' in changed_properties:
                 # crete and update a completely new object
@@ -198,9 +228,9 @@ class DirectoryUserProvider(ResourceProvider):
         self.success("User Updated")
 
     def delete(self):
-        if self.physical_resource_id in ['failed-to-create', 'deleted']:
+        if self.physical_resource_id in ['failed-to-create', 'could-not-create', 'deleted']:
             return
-        workdocs = boto3.client("workdocs", region_name=self.region)
+        workdocs = clients.get("workdocs", self.region)
         users = workdocs.describe_users(UserIds=self.physical_resource_id)
         if not users:
             log.warning(f"Requested user no longer exist: {self.physical_resource_id}")
@@ -211,8 +241,6 @@ class DirectoryUserProvider(ResourceProvider):
         self.physical_resource_id = 'deleted'
 
 
-provider = DirectoryUserProvider()
-
-
 def handler(request, context):
-    return provider.handle(request, context)
+    # providers hold per-request state so each request gets its own instance
+    return DirectoryUserProvider().handle(request, context)
@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import logging
+
+from botocore.exceptions import ClientError
+
+from clients import clients
+
+log = logging.getLogger()
+
+
+PENDING = 'PENDING'
+COMPLETED = 'COMPLETED'
+
+
+class PendingOperations(object):
+    """
+    Small table of asynchronous operations awaiting a state-change event, keyed by the id of the resource they act on.
+
+    Each record holds the CloudFormation request and the response built so far so that whichever path observes
+    completion first (the state-change event or the scheduled fallback check) can send the response.  `complete` is a
+    conditional write so exactly one path wins; `reopen` hands the operation back if that path fails to respond.
+    Records expire through the table's TTL on `ExpiresAt`.
+    """
+    def __init__(self, table_name=None, ttl=86400):
+        self.table_name = table_name
+        self.ttl = ttl
+
+    @property
+    def enabled(self):
+        return bool(self.table_name)
+
+    def put(self, key, request, response):
+        clients.get('dynamodb').put_item(TableName=self.table_name, Item={
+            'Key': {'S': key},
+            'RequestId': {'S': request['RequestId']},
+            'Request': {'S': json.dumps(request)},
+            'Response': {'S': json.dumps(response)},
+            'Status': {'S': PENDING},
+            'ExpiresAt': {'N': str(int(time.time()) + self.ttl)},
+        })
+
+    def get(self, key):
+        """
+        returns the record for `key` (with Request and Response decoded) or None
+        """
+        item = clients.get('dynamodb').get_item(
+            TableName=self.table_name, Key={'Key': {'S': key}}, ConsistentRead=True,
+        ).get('Item')
+        if item is None:
+            return None
+        return {
+            'Key': key,
+            'RequestId': item['RequestId']['S'],
+            'Request': json.loads(item['Request']['S']),
+            'Response': json.loads(item['Response']['S']),
+            'Status': item['Status']['S'],
+        }
+
+    def complete(self, key, request_id):
+        """
+        marks the operation completed, returning False if it was already completed (or replaced) by another path
+        """
+        return self.transition(key, request_id, PENDING, COMPLETED)
+
+    def reopen(self, key, request_id):
+        """
+        marks a completed operation pending again, e.g. when its response could not be sent
+        """
+        return self.transition(key, request_id, COMPLETED, PENDING)
+
+    def transition(self, key, request_id, current, status):
+        try:
+            clients.get('dynamodb').update_item(
+                TableName=self.table_name,
+                Key={'Key': {'S': key}},
+                UpdateExpression='SET #status = :status',
+                ConditionExpression='#status = :current AND RequestId = :request_id',
+                ExpressionAttributeNames={'#status': 'Status'},
+                ExpressionAttributeValues={
+                    ':status': {'S': status},
+                    ':current': {'S': current},
+                    ':request_id': {'S': request_id},
+                },
+            )
+            return True
+        except ClientError as error:
+            if error.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+pending_operations = PendingOperations(os.getenv('PENDING_OPERATIONS_TABLE'))
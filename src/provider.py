@@ -10,7 +10,9 @@ import directory_registration_provider, directory_user_provider
 
 
 def handler(request, context):
-    if request["ResourceType"] == "Custom::WorkspacesDirectoryRegistration":
+    if directory_registration_provider.is_state_change_event(request):
+        return directory_registration_provider.handle_event(request, context)
+    elif request["ResourceType"] == "Custom::WorkspacesDirectoryRegistration":
         return directory_registration_provider.handler(request, context)
     elif request["ResourceType"] == "Custom::DirectoryUser":
         return directory_user_provider.handler(request, context)
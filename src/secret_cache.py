@@ -0,0 +1,127 @@
+import os
+import re
+import time
+import logging
+import threading
+
+from clients import clients
+
+log = logging.getLogger()
+
+
+# service limits on the number of identifiers accepted by a single batch call
+SECRETS_MANAGER_BATCH_SIZE = 20
+SSM_BATCH_SIZE = 10
+
+
+SECRETS_MANAGER_ARN = re.compile(r'^arn:[^:]+:secretsmanager:')
+# Secrets Manager appends a random 6 character suffix to the name in a secret's full ARN
+SECRET_ARN_SUFFIX = re.compile(r'-[A-Za-z0-9]{6}$')
+
+
+def is_secrets_manager_reference(reference):
+    return SECRETS_MANAGER_ARN.match(reference) is not None
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class SecretCache(object):
+    """
+    In-container cache of secret values keyed by (region, reference).
+
+    A reference is either a Secrets Manager ARN or an SSM (SecureString) parameter name or ARN.  Values are kept for `ttl`
+    seconds so that many resources sharing a secret cost one lookup per container instead of one per resource.
+    Misses are resolved in batches using `batch_get_secret_value` and `get_parameters`.
+    """
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.values = {}
+        self.lock = threading.Lock()
+        # serializes fetches so concurrent misses for a shared secret result in a single lookup
+        self.fetch_lock = threading.Lock()
+
+    def lookup(self, references, region):
+        """
+        returns the unexpired cached values for `references`
+        """
+        now = time.time()
+        with self.lock:
+            entries = {reference: self.values.get((region, reference)) for reference in set(references)}
+        return {reference: entry[0] for reference, entry in entries.items() if entry is not None and entry[1] >= now}
+
+    def get(self, reference, region=None):
+        return self.get_many([reference], region)[reference]
+
+    def get_many(self, references, region=None):
+        """
+        returns a dict mapping each reference to its secret value, fetching any missing or expired entries in batches.
+        raises KeyError if a reference cannot be resolved.
+        """
+        result = self.lookup(references, region)
+        if len(result) < len(set(references)):
+            with self.fetch_lock:
+                # another thread may have fetched while we waited
+                result = self.lookup(references, region)
+                missing = set(references) - set(result.keys())
+                fetched = {}
+                for batch in chunks(sorted(r for r in missing if is_secrets_manager_reference(r)),
+                                    SECRETS_MANAGER_BATCH_SIZE):
+                    fetched.update(self.fetch_secrets(batch, region))
+                for batch in chunks(sorted(r for r in missing if not is_secrets_manager_reference(r)),
+                                    SSM_BATCH_SIZE):
+                    fetched.update(self.fetch_parameters(batch, region))
+                expires = time.time() + self.ttl
+                with self.lock:
+                    for reference, value in fetched.items():
+                        self.values[(region, reference)] = (value, expires)
+                result.update(fetched)
+        unresolved = set(references) - set(result.keys())
+        if unresolved:
+            raise KeyError(f'Unable to resolve secret(s): {", ".join(sorted(unresolved))}')
+        return result
+
+    def invalidate(self, reference=None, region=None):
+        with self.lock:
+            if reference is None:
+                self.values.clear()
+            else:
+                self.values.pop((region, reference), None)
+
+    # Fetch Methods
+    def fetch_secrets(self, references, region):
+        secretsmanager = clients.get('secretsmanager', region)
+        log.info(f'fetching {len(references)} secret(s) from Secrets Manager')
+        values = {}
+        arguments = {'SecretIdList': references}
+        while True:
+            response = secretsmanager.batch_get_secret_value(**arguments)
+            for secret in response.get('SecretValues', []):
+                # references may be the full ARN or the partial ARN (without the suffix) so match either exactly
+                arns = {secret['ARN'], SECRET_ARN_SUFFIX.sub('', secret['ARN'])}
+                for reference in arns.intersection(references):
+                    values[reference] = secret['SecretString']
+            for error in response.get('Errors', []):
+                log.warning(f"Unable to fetch secret {error.get('SecretId')}: {error.get('Message')}")
+            if not response.get('NextToken'):
+                break
+            arguments['NextToken'] = response['NextToken']
+        return values
+
+    def fetch_parameters(self, references, region):
+        ssm = clients.get('ssm', region)
+        log.info(f'fetching {len(references)} parameter(s) from SSM')
+        response = ssm.get_parameters(Names=references, WithDecryption=True)
+        for name in response.get('InvalidParameters', []):
+            log.warning(f'Unable to fetch parameter {name}')
+        values = {}
+        for parameter in response['Parameters']:
+            # get_parameters accepts names or ARNs but always reports the bare name, so match either
+            for reference in {parameter['Name'], parameter.get('ARN')}.intersection(references):
+                values[reference] = parameter['Value']
+        return values
+
+
+secret_cache = SecretCache(ttl=int(os.getenv('SECRET_CACHE_TTL', '300')))
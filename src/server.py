@@ -0,0 +1,185 @@
+"""
+Long-running server mode: serves provider requests from an SQS queue using a pool of worker threads.
+
+The queue receives CloudFormation custom resource requests (directly or through an SNS topic used as the ServiceToken)
+and state-change events.  Each request is handled by its own provider instance while boto3 clients and the secret cache
+are shared by all workers, so warm state survives across requests.
+
+    SERVER_QUEUE_URL=https://sqs... SERVER_WORKERS=8 python src/server.py
+"""
+import os
+import json
+import time
+import signal
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import provider
+from clients import clients
+from secret_cache import secret_cache
+
+log = logging.getLogger()
+
+# extra visibility beyond the request timeout so a message is not redelivered while its request is still being answered
+VISIBILITY_MARGIN = 120
+
+
+class ServerContext(object):
+    """
+    Stands in for the Lambda context so providers can budget long-running checks as they would in Lambda.
+
+    Checks that outlast the budget are handed off by re-invoking the Lambda named by `function_name`, so
+    PROVIDER_FUNCTION_NAME must name a deployed provider function for those to complete.
+    """
+    def __init__(self, request_id, timeout):
+        self.aws_request_id = request_id
+        self.function_name = os.getenv('PROVIDER_FUNCTION_NAME')
+        self.deadline = time.time() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - time.time()) * 1000))
+
+
+def parse_message(body):
+    """
+    returns the request in an SQS message body, raising ValueError if it is not a JSON object
+    """
+    request = json.loads(body)
+    # unwrap requests delivered through an SNS subscription
+    if isinstance(request, dict) and request.get('Type') == 'Notification' and isinstance(request.get('Message'), str):
+        request = json.loads(request['Message'])
+    if not isinstance(request, dict):
+        raise ValueError(f'Expected a JSON object, found {type(request).__name__}')
+    return request
+
+
+def prefetch_secrets(requests):
+    """
+    resolves the password secrets of all user creations in a batch with as few lookups as possible
+    """
+    references = {}
+    for request in requests:
+        if request.get('ResourceType') != 'Custom::DirectoryUser' or request.get('RequestType') != 'Create':
+            continue
+        properties = request.get('ResourceProperties')
+        if isinstance(properties, dict) and 'PasswordSecret' in properties:
+            references.setdefault(properties.get('Region'), set()).add(properties['PasswordSecret'])
+    for region, region_references in references.items():
+        try:
+            secret_cache.get_many(region_references, region)
+        except Exception as error:
+            # each request reports its own failure when it resolves the secret
+            log.warning(f'Unable to prefetch secrets: {error}')
+
+
+class Server(object):
+    def __init__(self, queue_url, workers=4, timeout=900, region=None):
+        self.queue_url = queue_url
+        self.workers = workers
+        self.timeout = timeout
+        self.region = region
+        self.running = False
+        # bounds received-but-unprocessed messages so they aren't hidden from other servers while queued here
+        self.slots = threading.Semaphore(workers)
+
+    def process(self, message, request):
+        try:
+            try:
+                provider.handler(request, ServerContext(message['MessageId'], self.timeout))
+            except Exception:
+                # the provider has run (and responded if it could), so a redelivery would only repeat its side effects
+                log.exception(f"Failed to process message {message['MessageId']}")
+            clients.get('sqs', self.region).delete_message(
+                QueueUrl=self.queue_url, ReceiptHandle=message['ReceiptHandle'])
+        except Exception:
+            log.exception(f"Failed to delete message {message['MessageId']}")
+        finally:
+            self.slots.release()
+
+    def release(self, messages):
+        """
+        makes received messages that will not be processed visible to other servers again
+        """
+        for message in messages:
+            try:
+                clients.get('sqs', self.region).change_message_visibility(
+                    QueueUrl=self.queue_url, ReceiptHandle=message['ReceiptHandle'], VisibilityTimeout=0)
+            except Exception:
+                log.exception(f"Failed to release message {message['MessageId']}")
+            finally:
+                self.slots.release()
+
+    def receive(self):
+        # wait for at least one free worker, then claim as many as are free (up to the SQS limit)
+        self.slots.acquire()
+        available = 1
+        while available < min(self.workers, 10) and self.slots.acquire(blocking=False):
+            available += 1
+        try:
+            response = clients.get('sqs', self.region).receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=available,
+                WaitTimeSeconds=20,
+                VisibilityTimeout=self.timeout + VISIBILITY_MARGIN,
+            )
+        except Exception:
+            for _ in range(available):
+                self.slots.release()
+            raise
+        messages = response.get('Messages', [])
+        for _ in range(available - len(messages)):
+            self.slots.release()
+        return messages
+
+    def serve(self):
+        if not os.getenv('PROVIDER_FUNCTION_NAME'):
+            raise ValueError('PROVIDER_FUNCTION_NAME must name the provider function that checks outlasting '
+                             'SERVER_REQUEST_TIMEOUT are handed off to')
+        self.running = True
+        log.info(f'serving {self.queue_url} with {self.workers} workers')
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while self.running:
+                try:
+                    messages = self.receive()
+                except Exception:
+                    log.exception('Failed to receive messages')
+                    time.sleep(5)
+                    continue
+                if not self.running:
+                    # stopped while waiting on the queue
+                    self.release(messages)
+                    break
+                requests = {}
+                for message in messages:
+                    try:
+                        requests[message['MessageId']] = parse_message(message['Body'])
+                    except ValueError:
+                        # left on the queue for the dead letter queue
+                        log.exception(f"Invalid message {message['MessageId']}")
+                        self.slots.release()
+                prefetch_secrets(requests.values())
+                for message in messages:
+                    if message['MessageId'] in requests:
+                        executor.submit(self.process, message, requests[message['MessageId']])
+        log.info('server stopped')
+
+    def stop(self, *args):
+        log.info('stopping server after in-flight requests complete')
+        self.running = False
+
+
+def main():
+    server = Server(
+        queue_url=os.environ['SERVER_QUEUE_URL'],
+        workers=int(os.getenv('SERVER_WORKERS', '4')),
+        timeout=int(os.getenv('SERVER_REQUEST_TIMEOUT', '900')),
+        region=os.getenv('AWS_REGION'),
+    )
+    signal.signal(signal.SIGTERM, server.stop)
+    signal.signal(signal.SIGINT, server.stop)
+    server.serve()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+import json
+import uuid
+
+import pytest
+from botocore.exceptions import ClientError
+from cfn_resource_provider import ResourceProvider
+
+import provider
+import directory_registration_provider
+from clients import clients
+from directory_registration_provider import WorkspacesDirectoryRegistrationProvider, state_change_event
+from pending_operations import pending_operations, PendingOperations, COMPLETED, PENDING
+
+DIRECTORY_ID = 'd-1234567890'
+EVENT_SOURCE = 'test.harness'
+FUNCTION_ARN = 'arn:aws:lambda:us-east-1:123456789012:function:cfn-custom-provider-template'
+
+
+@pytest.fixture(autouse=True)
+def event_mode(monkeypatch):
+    monkeypatch.setattr(pending_operations, 'table_name', 'pending-operations')
+    monkeypatch.setattr(directory_registration_provider, 'EVENT_SOURCE', EVENT_SOURCE)
+    monkeypatch.setattr(directory_registration_provider, 'CHECK_ROLE_ARN', 'arn:aws:iam::123456789012:role/check')
+    yield
+    clients.clients.clear()
+
+
+@pytest.fixture
+def responses(monkeypatch):
+    sent = []
+    monkeypatch.setattr(ResourceProvider, 'send_response', lambda self: sent.append(dict(self.response)))
+    return sent
+
+
+def test_create_defers_to_event(responses):
+    dynamodb, workspaces, scheduler = install(StubDynamoDB(), StubWorkSpaces(), StubScheduler())
+    request = Request('Create')
+    registration = create(request)
+
+    assert registration.status == 'SUCCESS', registration.reason
+    assert 'register_workspace_directory' in workspaces.calls
+    record = pending_operations.get(DIRECTORY_ID)
+    assert record['Status'] == PENDING
+    assert record['RequestId'] == request['RequestId']
+    assert record['Request'] == request
+
+    # the invocation returns without describing the directory or responding
+    assert registration.is_ready()
+    registration.send_response()
+    assert 'describe_workspace_directories' not in workspaces.calls
+    assert responses == []
+
+    # with a single fallback check
+    assert len(scheduler.schedules) == 1
+    schedule = scheduler.schedules[0]
+    assert schedule['ScheduleExpression'].startswith('at(')
+    assert schedule['ActionAfterCompletion'] == 'DELETE'
+    assert schedule['Target']['Arn'] == FUNCTION_ARN
+    assert directory_registration_provider.is_state_change_event(json.loads(schedule['Target']['Input']))
+
+
+def test_create_keeps_registration_when_pending_operation_fails(responses):
+    dynamodb, workspaces, scheduler = install(StubDynamoDB(fail_put=True), StubWorkSpaces(), StubScheduler())
+    registration = create(Request('Create'))
+
+    assert registration.status == 'SUCCESS', registration.reason
+    assert 'deregister_workspace_directory' not in workspaces.calls
+    assert scheduler.schedules == []
+    # falls back to polling
+    assert not registration.is_ready()
+    workspaces.state = 'REGISTERED'
+    assert registration.is_ready()
+    registration.send_response()
+    assert responses[0]['Data']['RegistrationCode'] == 'wsabc+DEFGHI'
+
+
+def test_create_polls_when_check_cannot_be_scheduled(responses):
+    dynamodb, workspaces, scheduler = install(StubDynamoDB(), StubWorkSpaces(), StubScheduler(fail=True))
+    registration = create(Request('Create'))
+
+    # the operation is claimed so a late event does not respond as well
+    assert pending_operations.get(DIRECTORY_ID)['Status'] == COMPLETED
+    assert provider.handler(state_change_event(DIRECTORY_ID, 'REGISTERED'), {}) is None
+    workspaces.state = 'REGISTERED'
+    assert registration.is_ready()
+    registration.send_response()
+    assert len(responses) == 1
+
+
+def test_create_polls_without_function_arn():
+    dynamodb, workspaces, scheduler = install(StubDynamoDB(), StubWorkSpaces(), StubScheduler())
+    registration = create(Request('Create'), context={})
+
+    assert dynamodb.items == {}
+    assert scheduler.schedules == []
+    assert not registration.is_ready()
+
+
+def test_delete_keeps_deregistration_when_pending_operation_fails():
+    dynamodb, workspaces, scheduler = install(StubDynamoDB(fail_put=True), StubWorkSpaces(state='REGISTERED'), StubScheduler())
+    registration = WorkspacesDirectoryRegistrationProvider()
+    registration.set_request(Request('Delete', physical_resource_id='wsabc+DEFGHI'), Context())
+    registration.delete()
+
+    assert registration.status == 'SUCCESS'
+    assert registration.reason == ''
+    assert registration.physical_resource_id == 'deleted'
+    assert 'deregister_workspace_directory' in workspaces.calls
+
+
+def test_event_completes_pending_request(responses):
+    dynamodb, workspaces, scheduler = install(StubDynamoDB(), StubWorkSpaces(), StubScheduler())
+    create(Request('Create'))
+
+    workspaces.state = 'REGISTERED'
+    provider.handler(state_change_event(DIRECTORY_ID, 'REGISTERED'), Context())
+    assert len(responses) == 1
+    assert responses[0]['Status'] == 'SUCCESS', responses[0]['Reason']
+    assert responses[0]['PhysicalResourceId'] == 'wsabc+DEFGHI'
+    assert pending_operations.get(DIRECTORY_ID)['Status'] == COMPLETED
+
+    # the fallback check finds nothing left to do
+    assert provider.handler(scheduled_check(scheduler), Context()) is None
+    assert len(responses) == 1
+    assert len(scheduler.schedules) == 1
+
+
+def test_event_during_transition_is_ignored(responses):
+    dynamodb, workspaces, scheduler = install(StubDynamoDB(), StubWorkSpaces(), StubScheduler())
+    create(Request('Create'))
+
+    assert provider.handler(state_change_event(DIRECTORY_ID, 'REGISTERING'), Context()) is None
+    assert responses == []
+    assert pending_operations.get(DIRECTORY_ID)['Status'] == PENDING
+    # the fallback check scheduled on create is still outstanding
+    assert len(scheduler.schedules) == 1
+
+
+def test_scheduled_check_reschedules_during_transition(responses):
+    dynamodb, workspaces, scheduler = install(StubDynamoDB(), StubWorkSpaces(), StubScheduler())
+    create(Request('Create'))
+
+    assert provider.handler(scheduled_check(scheduler), Context()) is None
+    assert len(scheduler.schedules) == 2
+    assert responses == []
+
+    workspaces.state = 'REGISTERED'
+    provider.handler(scheduled_check(scheduler), Context())
+    assert len(scheduler.schedules) == 2
+    assert len(responses) == 1
+    assert pending_operations.get(DIRECTORY_ID)['Status'] == COMPLETED
+
+
+def test_failed_response_reopens_pending_request(monkeypatch):
+    dynamodb, workspaces, scheduler = install(StubDynamoDB(), StubWorkSpaces(state='REGISTERED'), StubScheduler())
+    create(Request('Create'))
+
+    def fail(self):
+        raise ConnectionError('unable to reach ResponseURL')
+    monkeypatch.setattr(ResourceProvider, 'send_response', fail)
+    with pytest.raises(ConnectionError):
+        provider.handler(state_change_event(DIRECTORY_ID, 'REGISTERED'), Context())
+    assert pending_operations.get(DIRECTORY_ID)['Status'] == PENDING
+
+    # the retried event responds
+    sent = []
+    monkeypatch.setattr(ResourceProvider, 'send_response', lambda self: sent.append(dict(self.response)))
+    provider.handler(state_change_event(DIRECTORY_ID, 'REGISTERED'), Context())
+    assert len(sent) == 1
+    assert pending_operations.get(DIRECTORY_ID)['Status'] == COMPLETED
+
+
+def test_event_without_pending_operation_is_ignored(responses):
+    install(StubDynamoDB(), StubWorkSpaces(state='REGISTERED'), StubScheduler())
+    assert provider.handler(state_change_event('d-0000000000', 'REGISTERED'), Context()) is None
+    assert responses == []
+
+
+def test_event_from_other_source_is_not_routed():
+    event = state_change_event(DIRECTORY_ID, 'REGISTERED')
+    event['source'] = 'someone.else'
+    assert not directory_registration_provider.is_state_change_event(event)
+    assert directory_registration_provider.is_state_change_event(state_change_event(DIRECTORY_ID, 'REGISTERED'))
+
+
+def test_complete_and_reopen_are_conditional():
+    install(StubDynamoDB(), StubWorkSpaces(), StubScheduler())
+    operations = PendingOperations('pending-operations')
+    operations.put('key', {'RequestId': 'request-1'}, {})
+    assert not operations.reopen('key', 'request-1')
+    assert not operations.complete('key', 'request-2')
+    assert operations.complete('key', 'request-1')
+    assert not operations.complete('key', 'request-1')
+    assert operations.get('key')['Status'] == COMPLETED
+    assert not operations.reopen('key', 'request-2')
+    assert operations.reopen('key', 'request-1')
+    assert operations.get('key')['Status'] == PENDING
+
+
+def test_polling_only_without_event_source(monkeypatch):
+    monkeypatch.setattr(directory_registration_provider, 'EVENT_SOURCE', None)
+    dynamodb, workspaces, scheduler = install(StubDynamoDB(), StubWorkSpaces(), StubScheduler())
+    registration = create(Request('Create'))
+
+    assert dynamodb.items == {}
+    assert scheduler.schedules == []
+    assert not directory_registration_provider.is_state_change_event(state_change_event(DIRECTORY_ID, 'REGISTERED'))
+    workspaces.state = 'REGISTERED'
+    assert registration.is_ready()
+    assert dynamodb.gets == 0
+
+
+def scheduled_check(scheduler):
+    return json.loads(scheduler.schedules[-1]['Target']['Input'])
+
+
+def install(dynamodb, workspaces, scheduler):
+    clients.clients[('dynamodb', None)] = dynamodb
+    clients.clients[('workspaces', None)] = workspaces
+    clients.clients[('scheduler', None)] = scheduler
+    return dynamodb, workspaces, scheduler
+
+
+def create(request, context=None):
+    registration = WorkspacesDirectoryRegistrationProvider()
+    registration.set_request(request, context if context is not None else Context())
+    registration.create()
+    return registration
+
+
+class Context(object):
+    invoked_function_arn = FUNCTION_ARN
+
+
+class StubDynamoDB(object):
+
+    def __init__(self, fail_put=False):
+        self.items = {}
+        self.fail_put = fail_put
+        self.gets = 0
+
+    def put_item(self, TableName, Item):
+        if self.fail_put:
+            raise ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException'}}, 'PutItem')
+        self.items[Item['Key']['S']] = dict(Item)
+
+    def get_item(self, TableName, Key, ConsistentRead):
+        self.gets += 1
+        item = self.items.get(Key['Key']['S'])
+        return {'Item': dict(item)} if item is not None else {}
+
+    def update_item(self, TableName, Key, ExpressionAttributeValues, **kwargs):
+        item = self.items.get(Key['Key']['S'])
+        if item is None or item['Status'] != ExpressionAttributeValues[':current'] \
+                or item['RequestId'] != ExpressionAttributeValues[':request_id']:
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'UpdateItem')
+        item['Status'] = ExpressionAttributeValues[':status']
+
+
+class StubScheduler(object):
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.schedules = []
+
+    def create_schedule(self, **kwargs):
+        if self.fail:
+            raise ClientError({'Error': {'Code': 'AccessDeniedException'}}, 'CreateSchedule')
+        self.schedules.append(kwargs)
+
+
+class StubWorkSpaces(object):
+
+    def __init__(self, state='REGISTERING'):
+        self.state = state
+        self.calls = []
+
+    def register_workspace_directory(self, **kwargs):
+        self.calls.append('register_workspace_directory')
+
+    def deregister_workspace_directory(self, **kwargs):
+        self.calls.append('deregister_workspace_directory')
+
+    def describe_workspace_directories(self, DirectoryIds):
+        self.calls.append('describe_workspace_directories')
+        return {'Directories': [{
+            'DirectoryId': DirectoryIds[0],
+            'State': self.state,
+            'RegistrationCode': 'wsabc+DEFGHI',
+            'CustomerUserName': 'Administrator',
+            'IamRoleId': 'arn:aws:iam::123456789012:role/workspaces_DefaultRole',
+            'WorkspaceSecurityGroupId': 'sg-12345678',
+        }]}
+
+
+class Request(dict):
+
+    def __init__(self, request_type, physical_resource_id=None):
+        request_id = 'request-%s' % uuid.uuid4()
+        self.update({
+            'RequestType': request_type,
+            'ResponseURL': 'https://httpbin.org/put',
+            'StackId': 'arn:aws:cloudformation:us-west-2:EXAMPLE/stack-name/guid',
+            'RequestId': request_id,
+            'ResourceType': 'Custom::WorkspacesDirectoryRegistration',
+            'LogicalResourceId': 'DirectoryRegistration',
+            'ResourceProperties': {
+                'DirectoryId': DIRECTORY_ID,
+                'EnableWorkDocs': True,
+            }})
+
+        self['PhysicalResourceId'] = physical_resource_id if physical_resource_id is not None else 'initial-%s' % str(uuid.uuid4())
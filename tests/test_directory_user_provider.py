@@ -0,0 +1,151 @@
+import uuid
+
+from clients import clients
+from directory_user_provider import DirectoryUserProvider
+from secret_cache import secret_cache
+
+SECRET_ARN = 'arn:aws:secretsmanager:us-east-1:123456789012:secret:initial-password'
+
+
+def teardown_function():
+    clients.clients.clear()
+    secret_cache.invalidate()
+
+
+def test_password_or_secret_required():
+    for properties in [{}, {'Password': 'p', 'PasswordSecret': SECRET_ARN}]:
+        provider = DirectoryUserProvider()
+        provider.set_request(Request('Create', **properties), {})
+        assert not provider.is_valid_request()
+        assert provider.status == 'FAILED'
+        assert 'PasswordSecret' in provider.reason
+
+
+def test_password_or_secret_accepted():
+    for properties in [{'Password': 'p'}, {'PasswordSecret': SECRET_ARN}]:
+        provider = DirectoryUserProvider()
+        provider.set_request(Request('Create', **properties), {})
+        assert provider.is_valid_request(), provider.reason
+
+
+def test_create_with_password_secret():
+    workdocs = StubWorkDocs()
+    clients.clients[('workdocs', None)] = workdocs
+    clients.clients[('secretsmanager', None)] = StubSecretsManager()
+    provider = DirectoryUserProvider()
+    provider.set_request(Request('Create', PasswordSecret=SECRET_ARN), {})
+    assert provider.is_valid_request(), provider.reason
+    provider.create()
+
+    assert provider.status == 'SUCCESS', provider.reason
+    assert provider.physical_resource_id == 'user-1'
+    name, arguments = workdocs.calls[0]
+    assert name == 'create_user'
+    assert arguments['Password'] == 'from-secret'
+    assert 'PasswordSecret' not in arguments
+    assert ('deactivate_user', {'UserId': 'user-1'}) in workdocs.calls
+
+
+def test_create_with_password():
+    workdocs = StubWorkDocs()
+    clients.clients[('workdocs', None)] = workdocs
+    provider = DirectoryUserProvider()
+    provider.set_request(Request('Create', Password='plain'), {})
+    assert provider.is_valid_request(), provider.reason
+    provider.create()
+
+    assert provider.status == 'SUCCESS', provider.reason
+    assert workdocs.calls[0][1]['Password'] == 'plain'
+
+
+def test_create_with_unresolvable_secret():
+    workdocs = StubWorkDocs()
+    clients.clients[('workdocs', None)] = workdocs
+    clients.clients[('secretsmanager', None)] = StubSecretsManager(errors=True)
+    provider = DirectoryUserProvider()
+    provider.set_request(Request('Create', PasswordSecret=SECRET_ARN), {})
+    provider.execute()
+
+    assert provider.status == 'FAILED'
+    assert provider.physical_resource_id == 'failed-to-create'
+    assert workdocs.calls == []
+
+    # the rollback does not touch WorkDocs
+    provider = DirectoryUserProvider()
+    provider.set_request(Request('Delete', physical_resource_id='failed-to-create', PasswordSecret=SECRET_ARN), {})
+    provider.execute()
+    assert provider.status == 'SUCCESS', provider.reason
+    assert workdocs.calls == []
+
+
+def test_update_password_to_password_secret():
+    workdocs = StubWorkDocs()
+    clients.clients[('workdocs', None)] = workdocs
+    provider = DirectoryUserProvider()
+    request = Request('Update', physical_resource_id='user-1', PasswordSecret=SECRET_ARN)
+    request['OldResourceProperties'] = dict(request['ResourceProperties'], Password='plain')
+    del request['OldResourceProperties']['PasswordSecret']
+    provider.set_request(request, {})
+    provider.execute()
+
+    assert provider.status == 'SUCCESS', provider.reason
+    assert provider.physical_resource_id == 'user-1'
+    assert [name for name, _ in workdocs.calls if name == 'create_user'] == []
+    assert all('Password' not in arguments for _, arguments in workdocs.calls)
+
+
+class StubWorkDocs(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def create_user(self, **kwargs):
+        self.calls.append(('create_user', kwargs))
+        return {'User': {'Id': 'user-1'}}
+
+    def update_user(self, **kwargs):
+        self.calls.append(('update_user', kwargs))
+
+    def deactivate_user(self, **kwargs):
+        self.calls.append(('deactivate_user', kwargs))
+
+    def activate_user(self, **kwargs):
+        self.calls.append(('activate_user', kwargs))
+
+
+class StubSecretsManager(object):
+
+    def __init__(self, errors=False):
+        self.errors = errors
+
+    def batch_get_secret_value(self, SecretIdList):
+        if self.errors:
+            # per-secret failures are reported in the response rather than raised
+            return {'SecretValues': [], 'Errors': [
+                {'SecretId': SECRET_ARN, 'ErrorCode': 'AccessDeniedException', 'Message': 'denied'},
+            ]}
+        return {'SecretValues': [{'ARN': SECRET_ARN + '-AbCdEf', 'SecretString': 'from-secret'}]}
+
+
+class Request(dict):
+
+    def __init__(self, request_type, physical_resource_id=None, **properties):
+        request_id = 'request-%s' % uuid.uuid4()
+        resource_properties = {
+            'OrganizationId': 'd-1234567890',
+            'Username': 'jdoe',
+            'GivenName': 'Jane',
+            'Surname': 'Doe',
+        }
+        resource_properties.update(properties)
+        self.update({
+            'RequestType': request_type,
+            'ResponseURL': 'https://httpbin.org/put',
+            'StackId': 'arn:aws:cloudformation:us-west-2:EXAMPLE/stack-name/guid',
+            'RequestId': request_id,
+            'ResourceType': 'Custom::DirectoryUser',
+            'LogicalResourceId': 'MyUser',
+            'ResourceProperties': resource_properties,
+        })
+
+        self['PhysicalResourceId'] = physical_resource_id if physical_resource_id is not None else 'initial-%s' % str(uuid.uuid4())
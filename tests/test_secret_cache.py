@@ -0,0 +1,155 @@
+from clients import clients
+from secret_cache import SecretCache, is_secrets_manager_reference
+
+SECRET_ARN = 'arn:aws:secretsmanager:us-east-1:123456789012:secret:initial-password'
+PARTIAL_ARN = 'arn:aws:secretsmanager:us-east-1:123456789012:secret:pw'
+ADMIN_PARTIAL_ARN = 'arn:aws:secretsmanager:us-east-1:123456789012:secret:pw-admin'
+
+
+def teardown_function():
+    clients.clients.clear()
+
+
+def test_shared_secret_fetched_once():
+    cache = StubSecretCache()
+    for _ in range(5):
+        assert cache.get(SECRET_ARN) == 'secret-value'
+    assert cache.calls == [('secretsmanager', [SECRET_ARN])]
+
+
+def test_batch_lookup():
+    cache = StubSecretCache()
+    references = [SECRET_ARN, '/users/a', '/users/b']
+    values = cache.get_many(references)
+    assert values == {SECRET_ARN: 'secret-value', '/users/a': 'value-/users/a', '/users/b': 'value-/users/b'}
+    assert cache.calls == [('secretsmanager', [SECRET_ARN]), ('ssm', ['/users/a', '/users/b'])]
+
+
+def test_expired_entries_are_refetched():
+    cache = StubSecretCache(ttl=-1)
+    cache.get('/users/a')
+    cache.get('/users/a')
+    assert len(cache.calls) == 2
+
+
+def test_unresolved_reference():
+    cache = StubSecretCache()
+    try:
+        cache.get('/users/missing')
+        assert False, 'expected KeyError'
+    except KeyError:
+        pass
+
+
+def test_secrets_manager_reference_in_any_partition():
+    assert is_secrets_manager_reference(SECRET_ARN)
+    assert is_secrets_manager_reference('arn:aws-us-gov:secretsmanager:us-gov-west-1:123456789012:secret:pw')
+    assert is_secrets_manager_reference('arn:aws-cn:secretsmanager:cn-north-1:123456789012:secret:pw')
+    assert not is_secrets_manager_reference('/users/a')
+    assert not is_secrets_manager_reference('arn:aws:ssm:us-east-1:123456789012:parameter/users/a')
+
+
+def test_batch_get_secret_value_pagination_and_errors():
+    secretsmanager = StubSecretsManager([
+        {'SecretValues': [{'ARN': SECRET_ARN + '-AbCdEf', 'SecretString': 'first'}], 'NextToken': 'next'},
+        {
+            'SecretValues': [{'ARN': PARTIAL_ARN + '-123456', 'SecretString': 'second'}],
+            'Errors': [{'SecretId': ADMIN_PARTIAL_ARN, 'ErrorCode': 'ResourceNotFoundException', 'Message': 'missing'}],
+        },
+    ])
+    clients.clients[('secretsmanager', None)] = secretsmanager
+    cache = SecretCache()
+    try:
+        cache.get_many([SECRET_ARN, PARTIAL_ARN, ADMIN_PARTIAL_ARN])
+        assert False, 'expected KeyError'
+    except KeyError as error:
+        assert ADMIN_PARTIAL_ARN in str(error)
+    assert [call.get('NextToken') for call in secretsmanager.calls] == [None, 'next']
+    # the secrets that did resolve are cached
+    assert cache.get_many([SECRET_ARN, PARTIAL_ARN]) == {SECRET_ARN: 'first', PARTIAL_ARN: 'second'}
+    assert len(secretsmanager.calls) == 2
+
+
+def test_partial_arns_sharing_a_prefix():
+    values = [
+        {'ARN': PARTIAL_ARN + '-AbCdEf', 'SecretString': 'user'},
+        {'ARN': ADMIN_PARTIAL_ARN + '-GhIjKl', 'SecretString': 'admin'},
+    ]
+    # the mapping must not depend on the order of the results
+    for secret_values in [values, list(reversed(values))]:
+        clients.clients[('secretsmanager', None)] = StubSecretsManager([{'SecretValues': secret_values}])
+        assert SecretCache().get_many([PARTIAL_ARN, ADMIN_PARTIAL_ARN]) == {PARTIAL_ARN: 'user', ADMIN_PARTIAL_ARN: 'admin'}
+
+
+def test_get_parameters_invalid_parameters():
+    ssm = StubSsm({'/users/a': 'value-a'})
+    clients.clients[('ssm', 'us-east-1')] = ssm
+    cache = SecretCache()
+    try:
+        cache.get_many(['/users/a', '/users/missing'], 'us-east-1')
+        assert False, 'expected KeyError'
+    except KeyError as error:
+        assert '/users/missing' in str(error)
+    # the parameter that did resolve is cached
+    assert cache.get('/users/a', 'us-east-1') == 'value-a'
+    assert ssm.calls == [['/users/a', '/users/missing']]
+
+
+def test_get_parameters_batches_of_ten():
+    names = ['/users/%02d' % i for i in range(25)]
+    ssm = StubSsm({name: name for name in names})
+    clients.clients[('ssm', None)] = ssm
+    assert SecretCache().get_many(names) == {name: name for name in names}
+    assert [len(call) for call in ssm.calls] == [10, 10, 5]
+
+
+def test_get_parameters_by_arn():
+    arn = 'arn:aws:ssm:us-east-1:123456789012:parameter/users/a'
+    clients.clients[('ssm', None)] = StubSsm({'/users/a': 'value-a'})
+    assert SecretCache().get_many([arn, '/users/a']) == {arn: 'value-a', '/users/a': 'value-a'}
+
+
+class StubSecretCache(SecretCache):
+
+    def __init__(self, ttl=300):
+        super().__init__(ttl)
+        self.calls = []
+
+    def fetch_secrets(self, references, region):
+        self.calls.append(('secretsmanager', references))
+        return {reference: 'secret-value' for reference in references}
+
+    def fetch_parameters(self, references, region):
+        self.calls.append(('ssm', references))
+        return {reference: f'value-{reference}' for reference in references if reference != '/users/missing'}
+
+
+class StubSecretsManager(object):
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def batch_get_secret_value(self, **kwargs):
+        self.calls.append(kwargs)
+        return self.responses.pop(0)
+
+
+class StubSsm(object):
+
+    def __init__(self, parameters):
+        self.parameters = parameters
+        self.calls = []
+
+    def get_parameters(self, Names, WithDecryption):
+        assert WithDecryption
+        self.calls.append(Names)
+        # like SSM, accepts ARNs but reports the bare name
+        names = {name: '/' + name.split(':parameter/', 1)[1] if name.startswith('arn:') else name for name in Names}
+        return {
+            'Parameters': [
+                {'Name': name, 'ARN': f'arn:aws:ssm:us-east-1:123456789012:parameter{name}', 'Value': self.parameters[name]}
+                for name in set(names.values()) if name in self.parameters
+            ],
+            'InvalidParameters': [reference for reference, name in names.items() if name not in self.parameters],
+        }
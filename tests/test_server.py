@@ -0,0 +1,186 @@
+import json
+
+import pytest
+
+import server
+from clients import clients
+from secret_cache import secret_cache
+
+QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/123456789012/provider'
+SECRET_ARN = 'arn:aws:secretsmanager:us-east-1:123456789012:secret:initial-password'
+
+
+@pytest.fixture(autouse=True)
+def cleanup(monkeypatch):
+    monkeypatch.setenv('PROVIDER_FUNCTION_NAME', 'cfn-custom-provider-template')
+    yield
+    clients.clients.clear()
+    secret_cache.invalidate()
+
+
+@pytest.fixture
+def handled(monkeypatch):
+    requests = []
+    monkeypatch.setattr(server.provider, 'handler', lambda request, context: requests.append(request))
+    return requests
+
+
+def test_parse_message():
+    request = user_request('Create')
+    assert server.parse_message(json.dumps(request)) == request
+
+
+def test_parse_message_unwraps_sns():
+    request = user_request('Create')
+    body = json.dumps({'Type': 'Notification', 'Message': json.dumps(request)})
+    assert server.parse_message(body) == request
+
+
+def test_parse_message_rejects_non_objects():
+    for body in ['"x"', '[1]', '1', 'null', 'not json', json.dumps({'Type': 'Notification', 'Message': '[1]'})]:
+        try:
+            server.parse_message(body)
+            assert False, f'expected ValueError for {body}'
+        except ValueError:
+            pass
+
+
+def test_prefetch_secrets_groups_by_region(monkeypatch):
+    calls = []
+    monkeypatch.setattr(secret_cache, 'get_many', lambda references, region: calls.append((region, set(references))))
+    server.prefetch_secrets([
+        user_request('Create', PasswordSecret=SECRET_ARN),
+        user_request('Create', PasswordSecret=SECRET_ARN),
+        user_request('Create', PasswordSecret='/users/a', Region='eu-central-1'),
+        user_request('Create', Password='plain'),
+        user_request('Update', PasswordSecret='/users/updated'),
+        {'ResourceType': 'Custom::DirectoryUser', 'RequestType': 'Create', 'ResourceProperties': 'x'},
+    ])
+    assert sorted(calls, key=str) == sorted([(None, {SECRET_ARN}), ('eu-central-1', {'/users/a'})], key=str)
+
+
+def test_receive_releases_unused_slots():
+    sqs = StubSqs([[message('1', user_request('Create'))]])
+    clients.clients[('sqs', None)] = sqs
+    queue_server = server.Server(QUEUE_URL, workers=4)
+
+    messages = queue_server.receive()
+    assert len(messages) == 1
+    assert sqs.receives[0]['MaxNumberOfMessages'] == 4
+    # outlasts the request budget so the response is sent before the message can be redelivered
+    assert sqs.receives[0]['VisibilityTimeout'] > queue_server.timeout
+    assert free_slots(queue_server) == 3
+
+
+def test_receive_releases_slots_on_error():
+    clients.clients[('sqs', None)] = StubSqs([])
+    queue_server = server.Server(QUEUE_URL, workers=4)
+    try:
+        queue_server.receive()
+        assert False, 'expected an error'
+    except IndexError:
+        pass
+    assert free_slots(queue_server) == 4
+
+
+def test_serve_skips_invalid_messages(handled):
+    request = user_request('Create')
+    sqs = StubSqs([[message('1', 'x'), message('2', [1]), message('3', request)]])
+    clients.clients[('sqs', None)] = sqs
+    queue_server = server.Server(QUEUE_URL, workers=4)
+    # stop once the first batch has been received
+    sqs.on_empty = queue_server.stop
+    queue_server.serve()
+
+    assert handled == [request]
+    # invalid messages are left on the queue for the dead letter queue
+    assert sqs.deleted == ['receipt-3']
+    assert free_slots(queue_server) == 4
+
+
+def test_failed_request_is_deleted(monkeypatch):
+    def fail(request, context):
+        raise KeyError('No handler found')
+    monkeypatch.setattr(server.provider, 'handler', fail)
+    sqs = StubSqs([[message('1', user_request('Create'))]])
+    clients.clients[('sqs', None)] = sqs
+    queue_server = server.Server(QUEUE_URL, workers=2)
+    sqs.on_empty = queue_server.stop
+    queue_server.serve()
+
+    # the provider has run, so retrying would only repeat it
+    assert sqs.deleted == ['receipt-1']
+    assert free_slots(queue_server) == 2
+
+
+def test_stop_releases_received_messages(handled):
+    sqs = StubSqs([[message('1', user_request('Create')), message('2', user_request('Create'))]])
+    clients.clients[('sqs', None)] = sqs
+    queue_server = server.Server(QUEUE_URL, workers=4)
+    # stopped while the receive is waiting on the queue
+    sqs.on_receive = queue_server.stop
+    queue_server.serve()
+
+    assert handled == []
+    assert sqs.deleted == []
+    assert sqs.released == ['receipt-1', 'receipt-2']
+    assert len(sqs.receives) == 1
+    assert free_slots(queue_server) == 4
+
+
+def test_serve_requires_provider_function_name(monkeypatch):
+    monkeypatch.delenv('PROVIDER_FUNCTION_NAME')
+    sqs = StubSqs([])
+    clients.clients[('sqs', None)] = sqs
+    with pytest.raises(ValueError):
+        server.Server(QUEUE_URL).serve()
+    assert sqs.receives == []
+
+
+def free_slots(queue_server):
+    count = 0
+    while queue_server.slots.acquire(blocking=False):
+        count += 1
+    for _ in range(count):
+        queue_server.slots.release()
+    return count
+
+
+def message(message_id, body):
+    return {'MessageId': message_id, 'ReceiptHandle': f'receipt-{message_id}', 'Body': json.dumps(body)}
+
+
+def user_request(request_type, **properties):
+    return {
+        'RequestType': request_type,
+        'ResourceType': 'Custom::DirectoryUser',
+        'RequestId': 'request-1',
+        'ResourceProperties': properties,
+    }
+
+
+class StubSqs(object):
+
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.receives = []
+        self.deleted = []
+        self.released = []
+        self.on_empty = None
+        self.on_receive = None
+
+    def receive_message(self, **kwargs):
+        self.receives.append(kwargs)
+        if self.on_receive is not None:
+            self.on_receive()
+        if not self.batches and self.on_empty is not None:
+            self.on_empty()
+            return {}
+        return {'Messages': self.batches.pop(0)}
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        self.deleted.append(ReceiptHandle)
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+        assert VisibilityTimeout == 0
+        self.released.append(ReceiptHandle)